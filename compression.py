@@ -0,0 +1,115 @@
+import re
+
+import orjson
+
+from config import MAX_CONTEXT_MESSAGES, PROGRESSIVE_KEEP_LAST
+
+_WHITESPACE = re.compile(r"\s+")
+_WORD = re.compile(r"\w")
+SUMMARY_PREVIEW_CHARS = 80
+
+# Politeness and hedging that carry no meaning for the model. The lookarounds
+# keep resource names like `please-app` intact, and only the spaces after a
+# removed phrase are dropped so pasted YAML keeps its layout.
+_FILLER = re.compile(
+    r"(?<![\w./-])(?:please|could you|would you|can you|i would like to"
+    r"|i want you to|i think that|i believe that|it seems like|it appears that)"
+    r"(?![\w./-]),?[ \t]*",
+    re.IGNORECASE,
+)
+
+
+def _field(obj, name):
+    # Messages are either plain dicts or openai ChatCompletionMessage objects
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _summarize_tool_result(tool_name, content):
+    try:
+        result = orjson.loads(content)
+        output = result.get("stdout") or result.get("stderr") or ""
+        returncode = result.get("returncode")
+        status = "OK" if returncode == 0 else f"exit {returncode}"
+    except (orjson.JSONDecodeError, AttributeError):
+        output, status = content, "OK"
+    preview = _WHITESPACE.sub(" ", output).strip()[:SUMMARY_PREVIEW_CHARS]
+    return f"[{tool_name}] {status} ({len(output)} chars) | {preview}"
+
+
+def caveman(text):
+    """Strip filler phrases from a user message before it is sent to the model"""
+    compressed = _FILLER.sub("", text).strip()
+    # A message that is nothing but filler ("please", "can you?") is kept as
+    # is rather than sent empty or as bare punctuation
+    return compressed if _WORD.search(compressed) else text
+
+
+def compress_history(messages, keep_last=PROGRESSIVE_KEEP_LAST):
+    """
+    Return the messages to send to the API, with tool results from earlier
+    steps (all but the last `keep_last` of them) replaced by a one-line
+    summary. Results of the latest tool calls have not been read by the model
+    yet, so they are always sent in full.
+
+    The canonical list is never mutated; untouched messages are shared.
+    """
+    latest_call = max(
+        (
+            i
+            for i, message in enumerate(messages)
+            if _field(message, "role") == "assistant"
+            and _field(message, "tool_calls")
+        ),
+        default=len(messages),
+    )
+    tool_indexes = [
+        i
+        for i, message in enumerate(messages[:latest_call])
+        if _field(message, "role") == "tool"
+    ]
+    stale = set(tool_indexes[: max(len(tool_indexes) - keep_last, 0)])
+    if not stale:
+        return messages
+
+    tool_names = {}
+    for message in messages:
+        for tool_call in _field(message, "tool_calls") or []:
+            function = _field(tool_call, "function")
+            tool_names[_field(tool_call, "id")] = _field(function, "name")
+
+    return [
+        {
+            **message,
+            "content": _summarize_tool_result(
+                tool_names.get(message["tool_call_id"], "tool"), message["content"]
+            ),
+        }
+        if i in stale
+        else message
+        for i, message in enumerate(messages)
+    ]
+
+
+def context_window(messages, max_messages=MAX_CONTEXT_MESSAGES):
+    """
+    Return the system prompt plus at most `max_messages` of the latest
+    messages, so the prompt size stays bounded however long the turn runs.
+    The latest user message is always kept, even when the turn's own tool
+    chatter alone fills the window.
+    """
+    if len(messages) <= max_messages + 1:
+        return messages
+    start = len(messages) - max_messages
+    window = messages[start:]
+    # A tool result whose assistant tool_calls message was cut off is invalid
+    while window and _field(window[0], "role") == "tool":
+        window = window[1:]
+    last_user = max(
+        (i for i, message in enumerate(messages) if _field(message, "role") == "user"),
+        default=None,
+    )
+    if last_user is not None and 0 < last_user < start:
+        return [messages[0], messages[last_user], *window]
+    return [messages[0], *window]
@@ -0,0 +1,51 @@
+from dotenv import load_dotenv
+import os
+
+# The only place .env is read; everything else imports its settings from here
+load_dotenv(override=True)
+
+
+def _optional(name, default, cast):
+    # An empty value turns the setting off, e.g. for models that reject it
+    value = os.getenv(name, default)
+    return cast(value) if value else None
+
+
+CONTEXT = os.getenv("CONTEXT")
+
+K8S_HELPER_MODEL_NAME = os.getenv("K8S_HELPER_MODEL_NAME")
+K8S_HELPER_BASE_URL = os.getenv("K8S_HELPER_BASE_URL")
+K8S_HELPER_API_KEY = os.getenv("K8S_HELPER_API_KEY")
+
+EARLY_STOP_VALIDATOR_MODEL_NAME = os.getenv("EARLY_STOP_VALIDATOR_MODEL_NAME")
+EARLY_STOP_VALIDATOR_BASE_URL = os.getenv("EARLY_STOP_VALIDATOR_BASE_URL")
+EARLY_STOP_VALIDATOR_API_KEY = os.getenv("EARLY_STOP_VALIDATOR_API_KEY")
+# Reasoning models reject a temperature (and a small token cap starves their
+# reasoning), so both can be set empty to leave them out of the request
+EARLY_STOP_VALIDATOR_MAX_TOKENS = _optional(
+    "EARLY_STOP_VALIDATOR_MAX_TOKENS", "200", int
+)
+EARLY_STOP_VALIDATOR_TEMPERATURE = _optional(
+    "EARLY_STOP_VALIDATOR_TEMPERATURE", "0", float
+)
+
+SUMMARY_KEEPER_MODEL_NAME = os.getenv("SUMMARY_KEEPER_MODEL_NAME")
+SUMMARY_KEEPER_MAX_TOKENS = _optional("SUMMARY_KEEPER_MAX_TOKENS", "256", int)
+SUMMARY_KEEPER_TEMPERATURE = _optional("SUMMARY_KEEPER_TEMPERATURE", "0", float)
+
+# Tool results older than the last N are summarized before each LLM call
+PROGRESSIVE_KEEP_LAST = int(os.getenv("PROGRESSIVE_KEEP_LAST", "2"))
+# Most recent messages (besides the system prompt) sent to the helper model
+MAX_CONTEXT_MESSAGES = int(os.getenv("MAX_CONTEXT_MESSAGES", "40"))
+# Characters of tool stdout/stderr kept when a result first enters history
+TOOL_OUTPUT_MAX_CHARS = int(os.getenv("TOOL_OUTPUT_MAX_CHARS", "4000"))
+# kubectl/helm processes allowed to run at the same time across all sessions
+TOOL_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", "8"))
+# Seconds a successful kubectl/helm read (get, list, ...) is reused; 0 disables
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "0"))
+# Cap on bytes read from each kubectl/helm output stream; 0 reads everything
+SUBPROCESS_MAX_OUTPUT_BYTES = int(os.getenv("SUBPROCESS_MAX_OUTPUT_BYTES", "0"))
+# Timeouts (seconds) of the HTTP client shared by the OpenAI clients; the read
+# timeout defaults to openai's own 600s so slow first tokens are not cut off
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "600"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
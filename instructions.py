@@ -1,11 +1,4 @@
-from dotenv import load_dotenv
-import os
-
-load_dotenv(override=True)
-
-CONTEXT = os.getenv("CONTEXT")
-
-print(f"CONTEXT: {CONTEXT}")
+from config import CONTEXT
 
 k8s_helper_instructions = f"""
     You help the user answer the questions 
@@ -19,7 +12,7 @@ k8s_helper_instructions = f"""
 """
 
 
-early_stop_validator_instructions = """
+early_stop_validator_instructions = f"""
     You check if a tool call is enough to answer the user's question.
     You get the user's question, short summary of the previous conversation and a tool call that was made.
     The user's question is always related only to the context {CONTEXT}.
@@ -50,8 +43,8 @@ summary_keeper_instructions = """
     If the previous summary doesn't have information related to the latest user message, discard the previous summary and do not mention it.
     The summary should be concise and be no longer than 1 sentence.
     Respond in JSON format:
-    {{
+    {
         "summary": str # the updated summary
-    }}
+    }
     Respond with JSON only, without any additional text or markdown formatting.
 """
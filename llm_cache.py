@@ -0,0 +1,47 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import orjson
+
+
+def make_cache_key(payload: Any) -> str:
+    """sha256 of the payload's canonical JSON (sorted keys)"""
+    return hashlib.sha256(
+        orjson.dumps(payload, option=orjson.OPT_SORT_KEYS, default=str)
+    ).hexdigest()
+
+
+class LLMCache:
+    """
+    In-process LRU cache for LLM responses, with optional expiry after
+    `ttl` seconds.
+
+    The methods are async so a shared backend (e.g. Redis) can be swapped in
+    without touching the call sites.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expiry on the monotonic clock or None, value)
+        self._entries: OrderedDict[str, tuple[Optional[float], Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
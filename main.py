@@ -1,17 +1,12 @@
 from __future__ import annotations
 
-from dotenv import load_dotenv
 from agents import Agent, Runner, trace
 import gradio as gr
-import os
 
+from config import K8S_HELPER_MODEL_NAME
 from tools import run_kubectl, run_helm
 from instructions import k8s_helper_instructions
 
-K8S_HELPER_MODEL_NAME = os.getenv("K8S_HELPER_MODEL_NAME")
-
-load_dotenv(override=True)
-
 
 k8s_helper = Agent(
     name="k8s-helper",
@@ -23,11 +18,11 @@ k8s_helper = Agent(
 
 async def chat(message, history):
     with trace("K8s helper"):
-        messages = []
-        for msg in history:
-            if isinstance(msg, dict) and "role" in msg and "content" in msg:
-                messages.append({"role": msg["role"], "content": msg["content"]})
-
+        messages = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in history
+            if isinstance(msg, dict) and "role" in msg and "content" in msg
+        ]
         messages.append({"role": "user", "content": message})
 
         response = await Runner.run(k8s_helper, messages)
@@ -36,7 +31,9 @@ async def chat(message, history):
 
 
 def main():
-    gr.ChatInterface(chat, type="messages").launch()
+    gr.ChatInterface(chat, type="messages").queue(
+        default_concurrency_limit=16, max_size=64
+    ).launch()
 
 
 if __name__ == "__main__":
@@ -1,36 +1,83 @@
 from __future__ import annotations
 
 import gradio as gr
-import json
-from dotenv import load_dotenv
-from openai import AsyncOpenAI
+import orjson
+from openai import APIError, AsyncOpenAI, DefaultAsyncHttpxClient
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageToolCall
+from pydantic import ValidationError
 import asyncio
-import os
-
-from tools import run_kubectl, run_helm, run_kubectl_impl, run_helm_impl
+import httpx
+import importlib.util
+
+from config import (
+    K8S_HELPER_MODEL_NAME,
+    K8S_HELPER_BASE_URL,
+    K8S_HELPER_API_KEY,
+    EARLY_STOP_VALIDATOR_MODEL_NAME,
+    EARLY_STOP_VALIDATOR_BASE_URL,
+    EARLY_STOP_VALIDATOR_API_KEY,
+    EARLY_STOP_VALIDATOR_MAX_TOKENS,
+    EARLY_STOP_VALIDATOR_TEMPERATURE,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_TIMEOUT,
+    TOOL_OUTPUT_MAX_CHARS,
+)
+from tools import (
+    run_kubectl,
+    run_helm,
+    run_kubectl_impl,
+    run_helm_impl,
+    truncate_output,
+)
+from compression import caveman, compress_history, context_window
 from instructions import k8s_helper_instructions, early_stop_validator_instructions
 from interfaces import EarlyStopEvaluation
+from llm_cache import LLMCache, make_cache_key
 from summary_keeper import get_summary
 
-load_dotenv(override=True)
-
-K8S_HELPER_MODEL_NAME = os.getenv("K8S_HELPER_MODEL_NAME")
-K8S_HELPER_BASE_URL = os.getenv("K8S_HELPER_BASE_URL")
-K8S_HELPER_API_KEY = os.getenv("K8S_HELPER_API_KEY")
-
-EARLY_STOP_VALIDATOR_MODEL_NAME = os.getenv("EARLY_STOP_VALIDATOR_MODEL_NAME")
-EARLY_STOP_VALIDATOR_BASE_URL = os.getenv("EARLY_STOP_VALIDATOR_BASE_URL")
-EARLY_STOP_VALIDATOR_API_KEY = os.getenv("EARLY_STOP_VALIDATOR_API_KEY")
-
-CONTEXT = os.getenv("CONTEXT")
-
 DEFAULT_EARLY_STOPPING_REASONING = "By default"
+DEFAULT_EARLY_STOP_EVALUATION = EarlyStopEvaluation(
+    should_stop=False, reasoning=DEFAULT_EARLY_STOPPING_REASONING
+)
+EARLY_STOP_CACHE_SIZE = 256
+# Sampling settings are left out of the request when unset in config
+EARLY_STOP_SAMPLING = {
+    key: value
+    for key, value in (
+        ("max_completion_tokens", EARLY_STOP_VALIDATOR_MAX_TOKENS),
+        ("temperature", EARLY_STOP_VALIDATOR_TEMPERATURE),
+    )
+    if value is not None
+}
+MAX_STEPS = 8
+
+HTTP_LIMITS = httpx.Limits(
+    max_connections=100, max_keepalive_connections=50, keepalive_expiry=75
+)
+HTTP_TIMEOUT = httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+# HTTP/2 multiplexes concurrent requests over one connection; it needs the
+# optional h2 package (`pip install "httpx[http2]"`)
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+WARMUP_TIMEOUT = 5.0
+
+
+# One pool for both clients, so calls to the same host reuse its connections
+shared_http_client = DefaultAsyncHttpxClient(
+    transport=httpx.AsyncHTTPTransport(
+        http2=HTTP2_ENABLED, retries=1, limits=HTTP_LIMITS
+    ),
+    timeout=HTTP_TIMEOUT,
+)
 
 k8s_helper_openai = AsyncOpenAI(
-    api_key=K8S_HELPER_API_KEY, base_url=K8S_HELPER_BASE_URL
+    api_key=K8S_HELPER_API_KEY,
+    base_url=K8S_HELPER_BASE_URL,
+    http_client=shared_http_client,
 )
 early_stop_validator_openai = AsyncOpenAI(
-    api_key=EARLY_STOP_VALIDATOR_API_KEY, base_url=EARLY_STOP_VALIDATOR_BASE_URL
+    api_key=EARLY_STOP_VALIDATOR_API_KEY,
+    base_url=EARLY_STOP_VALIDATOR_BASE_URL,
+    http_client=shared_http_client,
 )
 
 run_kubectl_json = {
@@ -51,34 +98,112 @@ tools = [
 ]
 
 
+_TOOL_REGISTRY = {
+    run_kubectl.name: run_kubectl_impl,
+    run_helm.name: run_helm_impl,
+}
+
+
 def get_tool_by_name(name):
-    if name == run_kubectl.name:
-        return run_kubectl_impl
-    if name == run_helm.name:
-        return run_helm_impl
-    raise ValueError(f"Tool {name} not found")
+    tool = _TOOL_REGISTRY.get(name)
+    if tool is None:
+        raise ValueError(f"Tool {name} not found")
+    return tool
 
 
-async def handle_tool_call(tool_calls):
-    results = []
-    for tool_call in tool_calls:
+async def handle_tool_call(tool_calls, arguments):
+    """Run `tool_calls` given their already parsed `arguments` (same order)"""
+    async def call_tool(tool_call, tool_arguments):
         tool_name = tool_call.function.name
-        arguments = json.loads(tool_call.function.arguments)
-        print(f"Tool called: {tool_name}", flush=True)
         tool = get_tool_by_name(tool_name)
-        result = await tool(**arguments) if tool else {}
-        results.append(
-            {
-                "role": "tool",
-                "content": result.model_dump_json(),
-                "tool_call_id": tool_call.id,
-            }
+        print(f"Tool called: {tool_name}", flush=True)
+        return await tool(**tool_arguments) if tool else {}
+
+    # Independent tool calls run concurrently; gather keeps their order
+    return await asyncio.gather(
+        *(
+            call_tool(tool_call, tool_arguments)
+            for tool_call, tool_arguments in zip(tool_calls, arguments)
+        )
+    )
+
+
+def _trim_result(result):
+    # Every later step re-sends the history, so large outputs are cut once here
+    stdout = truncate_output(result.stdout, TOOL_OUTPUT_MAX_CHARS)
+    stderr = truncate_output(result.stderr, TOOL_OUTPUT_MAX_CHARS)
+    if stdout is result.stdout and stderr is result.stderr:
+        return result
+    # The parsed JSON would carry the full output back in, so it goes too
+    return result.model_copy(
+        update={
+            "stdout": stdout,
+            "stderr": stderr,
+            "json": result.json if stdout is result.stdout else None,
+        }
+    )
+
+
+def to_tool_messages(tool_calls, results):
+    """Serialize execution results into the tool messages sent back to the LLM"""
+    return [
+        {
+            "role": "tool",
+            "content": _trim_result(result).model_dump_json(),
+            "tool_call_id": tool_call.id,
+        }
+        for tool_call, result in zip(tool_calls, results)
+    ]
+
+
+early_stop_cache = LLMCache(maxsize=EARLY_STOP_CACHE_SIZE)
+
+
+def early_stop_cache_key(summary, question, tool_call, tool_arguments):
+    # Everything the validator prompt is built from, so a verdict is only
+    # reused for the same question in the same conversation context
+    return make_cache_key(
+        {
+            "summary": summary,
+            "question": question.lower().strip(),
+            "tool": tool_call.function.name,
+            "arguments": tool_arguments,
+        }
+    )
+
+
+def merge_tool_call_deltas(parts, deltas):
+    """Accumulate streamed tool-call fragments into `parts`, keyed by index"""
+    for delta in deltas:
+        part = parts.setdefault(delta.index, {"id": None, "name": "", "arguments": ""})
+        if delta.id:
+            part["id"] = delta.id
+        if delta.function and delta.function.name:
+            part["name"] += delta.function.name
+        if delta.function and delta.function.arguments:
+            part["arguments"] += delta.function.arguments
+
+
+def build_tool_calls(parts):
+    return [
+        ChatCompletionMessageToolCall(
+            id=part["id"],
+            type="function",
+            function={"name": part["name"], "arguments": part["arguments"]},
         )
-    return results
+        for _, part in sorted(parts.items())
+    ]
 
 
-async def should_stop_early(summary, question, tool_call):
+async def should_stop_early(summary, question, tool_call, tool_arguments):
+    """`tool_arguments` are the call's arguments, already parsed by the caller"""
     print("Checking for early stopping...", flush=True)
+
+    cache_key = early_stop_cache_key(summary, question, tool_call, tool_arguments)
+    cached = await early_stop_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     messages = [
         {"role": "system", "content": early_stop_validator_instructions},
         {
@@ -86,27 +211,50 @@ async def should_stop_early(summary, question, tool_call):
             "content": f"""
                 Here is the user's question: {question}"
                 Here is a short summary of the previous conversation: {summary}
-                Here is the tool call that was made: {json.dumps(tool_call.model_dump())}.
+                Here is the tool call that was made: {tool_call.model_dump_json()}.
                 Is this enough to answer the user's question?
             """,
         },
     ]
 
-    response = await early_stop_validator_openai.chat.completions.create(
-        model=EARLY_STOP_VALIDATOR_MODEL_NAME, messages=messages, tools=tools
-    )
-
-    return EarlyStopEvaluation.model_validate_json(response.choices[0].message.content)
-
-
-async def default_early_stop_evaluation():
-    return EarlyStopEvaluation(
-        should_stop=False, reasoning=DEFAULT_EARLY_STOPPING_REASONING
+    # No tools here: the validator only answers in JSON, and the tool call it
+    # judges is already in the prompt, so the schema would be dead weight
+    try:
+        response = await early_stop_validator_openai.chat.completions.create(
+            model=EARLY_STOP_VALIDATOR_MODEL_NAME,
+            messages=messages,
+            **EARLY_STOP_SAMPLING,
+        )
+        evaluation = EarlyStopEvaluation.model_validate_json(
+            response.choices[0].message.content or ""
+        )
+    except (APIError, ValidationError) as error:
+        # The validator is advisory: a rejected request or a reply cut off at
+        # the token cap means carrying on with the tools, not failing the
+        # turn. Fallbacks are not cached.
+        print(f"Early stop check failed: {error!r}", flush=True)
+        return DEFAULT_EARLY_STOP_EVALUATION
+    await early_stop_cache.set(cache_key, evaluation)
+    return evaluation
+
+
+async def warm_up_clients():
+    """Open pooled connections so the first message skips the TCP/TLS handshake"""
+    await asyncio.gather(
+        *(
+            client.with_options(timeout=WARMUP_TIMEOUT, max_retries=0).models.list()
+            for client in (k8s_helper_openai, early_stop_validator_openai)
+        ),
+        return_exceptions=True,
     )
 
 
-async def chat_with_early_stop_streaming(message, history, current_summary):
+async def chat_with_early_stop_streaming(
+    message, history, current_summary, summary_cache=None
+):
     """Streaming version that yields intermediate early stop updates"""
+    # Gradio's history keeps what the user typed; the models get the short form
+    message = caveman(message)
     messages = (
         [{"role": "system", "content": k8s_helper_instructions}]
         + history
@@ -117,40 +265,89 @@ async def chat_with_early_stop_streaming(message, history, current_summary):
     early_stop_info = "**Early Stop Status**\n\nNo evaluation yet."
     processing_info = "Processing..."
 
-    new_summary_promise = asyncio.create_task(get_summary(current_summary, messages))
+    new_summary_promise = asyncio.create_task(
+        get_summary(current_summary, messages, summary_cache)
+    )
 
     while not done:
         step += 1
-
-        response = await k8s_helper_openai.chat.completions.create(
-            model=K8S_HELPER_MODEL_NAME, messages=messages, tools=tools
+        if step > MAX_STEPS:
+            new_summary = await new_summary_promise
+            yield (
+                f"Stopped after {MAX_STEPS} tool-calling steps without a final answer.",
+                early_stop_info,
+                new_summary.summary,
+            )
+            return
+
+        # Streamed so answer text reaches the UI as it is generated; tool
+        # calls arrive in fragments and are assembled once the stream ends
+        stream = await k8s_helper_openai.chat.completions.create(
+            model=K8S_HELPER_MODEL_NAME,
+            messages=compress_history(context_window(messages)),
+            tools=tools,
+            stream=True,
         )
+        content = ""
+        tool_call_parts = {}
+        finish_reason = None
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta.content:
+                content += choice.delta.content
+                yield content, early_stop_info, current_summary
+            if choice.delta.tool_calls:
+                merge_tool_call_deltas(tool_call_parts, choice.delta.tool_calls)
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+
+        if finish_reason == "tool_calls":
+            tool_calls = build_tool_calls(tool_call_parts)
+            message_obj = ChatCompletionMessage(
+                role="assistant", content=content or None, tool_calls=tool_calls
+            )
+            # Parsed once, shared by the tool runner, the validator and the
+            # progress message
+            arguments = [
+                orjson.loads(tool_call.function.arguments) for tool_call in tool_calls
+            ]
 
-        if response.choices[0].finish_reason == "tool_calls":
-            message_obj = response.choices[0].message
-            tool_calls = message_obj.tool_calls
+            # Start tool execution first: subprocess startup is the slow part
+            tool_task = asyncio.create_task(handle_tool_call(tool_calls, arguments))
 
-            early_stop_evaluator = default_early_stop_evaluation()
+            early_stop_evaluator = None
 
             if step == 1 and len(tool_calls) == 1:
-                early_stop_evaluator = should_stop_early(
-                    current_summary,
-                    messages[len(messages) - 1]["content"],
-                    tool_calls[0],
+                # Schedule now so the validator runs alongside the tool while
+                # the intermediate update below is being yielded
+                early_stop_evaluator = asyncio.create_task(
+                    should_stop_early(
+                        current_summary,
+                        message,
+                        tool_calls[0],
+                        arguments[0],
+                    )
                 )
 
-            # Start tool execution
-            tool_task = asyncio.create_task(handle_tool_call(tool_calls))
-
             # Wait for early stop evaluation and yield intermediate update
+            tool_lines = "\n".join(
+                f'Running tool "{tool_call.function.name}" with args: {tool_arguments["args"][:100]}'
+                for tool_call, tool_arguments in zip(tool_calls, arguments)
+            )
             processing_info = f"""
                 Calling tools... 
-                {'\n'.join([f'Running tool "{tool.function.name}" with args: {json.loads(tool.function.arguments)['args'][:100]}' for tool in tool_calls])}
+                {tool_lines}
             """
             yield processing_info, early_stop_info, current_summary
-            results, early_stop_evaluation = await asyncio.gather(
-                tool_task, early_stop_evaluator
-            )
+            if early_stop_evaluator is None:
+                results = await tool_task
+                early_stop_evaluation = DEFAULT_EARLY_STOP_EVALUATION
+            else:
+                results, early_stop_evaluation = await asyncio.gather(
+                    tool_task, early_stop_evaluator
+                )
 
             print(
                 f"Early stopping: {early_stop_evaluation.should_stop}.\n"
@@ -170,21 +367,21 @@ async def chat_with_early_stop_streaming(message, history, current_summary):
             yield processing_info, early_stop_info, current_summary
 
             if early_stop_evaluation.should_stop:
-                stdout_content = json.loads(results[0]["content"])["stdout"]
+                stdout_content = results[0].stdout
                 final_response = f"```\n{stdout_content}\n```"
                 new_summary = await new_summary_promise
                 yield final_response, early_stop_info, new_summary.summary
                 return  # Exit the generator without a value
             else:
                 messages.append(message_obj)
-                messages.extend(results)
+                messages.extend(to_tool_messages(tool_calls, results))
         else:
             done = True
 
     new_summary = await new_summary_promise
 
     # Final response
-    yield response.choices[0].message.content, early_stop_info, new_summary.summary
+    yield content, early_stop_info, new_summary.summary
 
 
 def main():
@@ -209,20 +406,25 @@ def main():
                     label="Summary",
                 )
 
-        global current_summary, current_early_stop_info
-        current_summary = ""
-        current_early_stop_info = "**Early Stop Status**\n\nNo evaluation yet."
+        # Per-session state, so concurrent users do not overwrite each other
+        summary_state = gr.State("")
+        early_stop_state = gr.State("**Early Stop Status**\n\nNo evaluation yet.")
+        # Gradio deep-copies this per session and passes the same object to
+        # every event, so entries added in place persist for that session
+        summary_cache_state = gr.State(LLMCache(ttl=3600))
 
-        async def respond(message, history):
+        async def respond(
+            message, history, current_summary, current_early_stop_info, summary_cache
+        ):
             """Handle chat responses and update early stop status"""
-            global current_summary, current_early_stop_info
-
             if not message:
                 yield (
                     history,
                     "",
                     "**Early Stop Status**\n\nNo evaluation yet.",
                     "**Current Summary**\n\nNo summary yet.",
+                    current_summary,
+                    current_early_stop_info,
                 )
                 return
 
@@ -234,7 +436,9 @@ def main():
                 response,
                 early_stop_info,
                 new_summary,
-            ) in chat_with_early_stop_streaming(message, history, current_summary):
+            ) in chat_with_early_stop_streaming(
+                message, history, current_summary, summary_cache
+            ):
                 current_summary = new_summary
                 current_early_stop_info = early_stop_info
                 summary_text = (
@@ -248,24 +452,46 @@ def main():
                     final_history = new_history + [
                         {"role": "assistant", "content": response}
                     ]
-                    yield final_history, "", early_stop_info, summary_text
+                    yield (
+                        final_history,
+                        "",
+                        early_stop_info,
+                        summary_text,
+                        current_summary,
+                        current_early_stop_info,
+                    )
                 else:
                     # Intermediate update - just update early stop status
-                    yield new_history, "", early_stop_info, summary_text
+                    yield (
+                        new_history,
+                        "",
+                        early_stop_info,
+                        summary_text,
+                        current_summary,
+                        current_early_stop_info,
+                    )
 
         msg.submit(
-            respond, [msg, chatbot], [chatbot, msg, early_stop_status, summary_display]
+            respond,
+            [msg, chatbot, summary_state, early_stop_state, summary_cache_state],
+            [
+                chatbot,
+                msg,
+                early_stop_status,
+                summary_display,
+                summary_state,
+                early_stop_state,
+            ],
         )
 
-        def handle_chatbot_clear(history):
+        def handle_chatbot_clear(history, current_summary, current_early_stop_info):
             """Handle when the chatbot is cleared via built-in clear button"""
-            global current_summary, current_early_stop_info
             if not history:  # If history is empty, chatbot was cleared
-                current_summary = ""
-                current_early_stop_info = "**Early Stop Status**\n\nNo evaluation yet."
                 return (
                     "**Early Stop Status**\n\nNo evaluation yet.",
                     "**Current Summary**\n\nNo summary yet.",
+                    "",
+                    "**Early Stop Status**\n\nNo evaluation yet.",
                 )
             # If history is not empty, return the current tracked values
             current_summary_text = (
@@ -273,16 +499,29 @@ def main():
                 if current_summary
                 else "**Current Summary**\n\nNo summary yet."
             )
-            return (current_early_stop_info, current_summary_text)
+            return (
+                current_early_stop_info,
+                current_summary_text,
+                current_summary,
+                current_early_stop_info,
+            )
 
         # Handle when chatbot is cleared using built-in clear button
         chatbot.change(
             handle_chatbot_clear,
-            inputs=[chatbot],
-            outputs=[early_stop_status, summary_display],
+            inputs=[chatbot, summary_state, early_stop_state],
+            outputs=[
+                early_stop_status,
+                summary_display,
+                summary_state,
+                early_stop_state,
+            ],
         )
 
-    interface.launch()
+        # Runs on Gradio's event loop, which is where the clients are used
+        interface.load(warm_up_clients, show_progress="hidden")
+
+    interface.queue(default_concurrency_limit=16, max_size=64).launch()
 
 
 if __name__ == "__main__":
@@ -1,21 +1,37 @@
-from agents import Agent, Runner
-import os
+from typing import Optional
 
+from agents import Agent, ModelSettings, Runner
+
+from config import (
+    SUMMARY_KEEPER_MAX_TOKENS,
+    SUMMARY_KEEPER_MODEL_NAME,
+    SUMMARY_KEEPER_TEMPERATURE,
+)
 from instructions import summary_keeper_instructions
 from interfaces import SummaryResponse
-
-SUMMARY_KEEPER_MODEL_NAME = os.getenv("SUMMARY_KEEPER_MODEL_NAME")
+from llm_cache import LLMCache, make_cache_key
 
 summary_keeper = Agent(
     name="summary-keeper",
     instructions=summary_keeper_instructions,
     model=SUMMARY_KEEPER_MODEL_NAME,
     output_type=SummaryResponse,
+    # A one-sentence summary; the cap guards against runaway generations
+    model_settings=ModelSettings(
+        max_tokens=SUMMARY_KEEPER_MAX_TOKENS, temperature=SUMMARY_KEEPER_TEMPERATURE
+    ),
 )
 
 
-async def get_summary(previous_summary: str, messages: list[dict]) -> SummaryResponse:
-    print("Updating summary...", flush=True)
+async def get_summary(
+    previous_summary: str,
+    messages: list[dict],
+    cache: Optional[LLMCache] = None,
+) -> SummaryResponse:
+    """
+    Summarize the conversation. `cache` should belong to the calling session;
+    without one, every call goes to the model.
+    """
     messages = [
         {
             "role": "user",
@@ -26,5 +42,15 @@ async def get_summary(previous_summary: str, messages: list[dict]) -> SummaryRes
         },
     ]
 
+    # Keyed on exactly the prompt the agent gets
+    cache_key = make_cache_key(messages)
+    if cache is not None:
+        cached = await cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    print("Updating summary...", flush=True)
     response = await Runner.run(summary_keeper, messages)
+    if cache is not None:
+        await cache.set(cache_key, response.final_output)
     return response.final_output
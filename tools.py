@@ -1,35 +1,284 @@
 import asyncio
-import json
+import os
+import re
 import shlex
 import shutil
 import subprocess
-from typing import List, Optional, Sequence, Union
+from functools import lru_cache
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+import orjson
 from agents import function_tool
 
+from config import SUBPROCESS_MAX_OUTPUT_BYTES, TOOL_CACHE_TTL, TOOL_MAX_CONCURRENCY
 from interfaces import ExecutionResult, EnvVar
+from llm_cache import LLMCache, make_cache_key
 
 
-@function_tool
-async def run_kubectl(
-    args: Union[str, Sequence[str]],
-    *,
-    namespace: Optional[str] = None,
-    context: Optional[str] = None,
-    kubeconfig: Optional[str] = None,
-    timeout: Optional[float] = 60.0,
-    capture_output: bool = True,
-    check: bool = False,
-    env: Optional[List[EnvVar]] = None,
-) -> ExecutionResult:
-    return await run_kubectl_impl(
-        args,
-        namespace=namespace,
-        context=context,
-        kubeconfig=kubeconfig,
-        timeout=timeout,
-        capture_output=capture_output,
-        check=check,
-        env=env,
+# Leading whitespace plus an opening bracket; matched in place, unlike lstrip()
+_JSON_START = re.compile(rb"\s*[{\[]")
+_JSON_OUTPUT_ARGS = frozenset({"-ojson", "-o=json", "--output=json"})
+_SHELL_QUOTING = frozenset("'\"\\")
+# Cap on the stdout/stderr text kept in a result (and so in the chat history)
+_MAX_OUTPUT = 256 * 1024
+# Bytes requested from a pipe per read when output is bounded
+_READ_CHUNK = 64 * 1024
+# Seconds to wait for a killed child to exit after a timeout
+_REAP_TIMEOUT = 5.0
+# Shared by all callers; binds to the running loop on first contended use
+_TOOL_SEMAPHORE = asyncio.Semaphore(TOOL_MAX_CONCURRENCY)
+# Verbs whose results may be served from the read cache (kubectl and helm)
+_READ_VERBS = frozenset(
+    {
+        "get",
+        "describe",
+        "api-resources",
+        "api-versions",
+        "version",
+        "list",
+        "status",
+        "history",
+    }
+)
+# Global kubectl/helm flags that may come before the verb with a separate value
+_VALUE_FLAGS = frozenset(
+    {
+        "-n",
+        "--namespace",
+        "--context",
+        "--kube-context",
+        "--kubeconfig",
+        "--cluster",
+        "--user",
+        "-s",
+        "--server",
+        "--as",
+        "--as-group",
+        "--request-timeout",
+        "--repository-config",
+        "--registry-config",
+        "--repository-cache",
+        "-v",
+    }
+)
+# Streaming reads never settle on one result, so they are never cached
+_STREAM_FLAGS = frozenset({"-w", "--watch", "--watch-only", "--follow"})
+_read_cache = LLMCache(ttl=TOOL_CACHE_TTL) if TOOL_CACHE_TTL > 0 else None
+
+
+@lru_cache(maxsize=8)
+def _which(name: str, path: Optional[str]) -> Optional[str]:
+    # Keyed on $PATH so a changed PATH is still picked up, while the common
+    # case skips the directory walk and stat() calls of shutil.which.
+    return shutil.which(name, path=path)
+
+
+def refresh_tool_paths() -> None:
+    """Forget resolved kubectl/helm paths, e.g. after installing a binary"""
+    _which.cache_clear()
+
+
+def _unless_in_env(
+    value: Optional[str], name: str, environ: Mapping[str, str]
+) -> Optional[str]:
+    # A flag equal to the env var the binary reads anyway is redundant
+    return None if value and environ.get(name) == value else value
+
+
+@lru_cache(maxsize=128)
+def _kubectl_flags(
+    namespace: Optional[str], context: Optional[str], kubeconfig: Optional[str]
+) -> Tuple[str, ...]:
+    # Agents reuse the same target for many calls, so this is built once each
+    flags: Tuple[str, ...] = ()
+    if namespace:
+        flags += ("--namespace", namespace)
+    if context:
+        flags += ("--context", context)
+    if kubeconfig:
+        flags += ("--kubeconfig", kubeconfig)
+    return flags
+
+
+@lru_cache(maxsize=128)
+def _helm_flags(
+    namespace: Optional[str],
+    context: Optional[str],
+    kubeconfig: Optional[str],
+    repo_config: Optional[str],
+    registry_config: Optional[str],
+) -> Tuple[str, ...]:
+    flags: Tuple[str, ...] = ()
+    if namespace:
+        flags += ("--namespace", namespace)
+    if context:
+        flags += ("--kube-context", context)
+    if kubeconfig:
+        flags += ("--kubeconfig", kubeconfig)
+    if repo_config:
+        flags += ("--repository-config", repo_config)
+    if registry_config:
+        flags += ("--registry-config", registry_config)
+    return flags
+
+
+async def _kill_and_reap(process: asyncio.subprocess.Process) -> None:
+    # A child stuck in uninterruptible sleep, or a grandchild holding the
+    # pipes open, can make wait() hang; give up after a bound instead.
+    # The event loop's child watcher still reaps the process once it exits.
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
+    try:
+        await asyncio.wait_for(process.wait(), timeout=_REAP_TIMEOUT)
+    except TimeoutError:
+        print(
+            f"Process {process.pid} not reaped {_REAP_TIMEOUT}s after kill",
+            flush=True,
+        )
+
+
+def _tokenize(args: Union[str, Sequence[str]]) -> List[str]:
+    if not isinstance(args, str):
+        return list(args)
+    # Without quotes or escapes shlex splits on whitespace only, like str.split
+    if _SHELL_QUOTING.isdisjoint(args):
+        return args.split()
+    return shlex.split(args)
+
+
+def _verb(cmd: List[str]) -> Optional[str]:
+    # The first argument that is neither a flag nor a flag's value; None when
+    # an unknown flag makes that ambiguous
+    args = iter(cmd[1:])
+    for arg in args:
+        if not arg.startswith("-"):
+            return arg
+        if arg in _VALUE_FLAGS:
+            next(args, None)
+        elif arg.startswith("--") and "=" not in arg:
+            return None
+    return None
+
+
+def _read_cache_key(
+    cmd: List[str],
+    capture_output: bool,
+    check: bool,
+    environ: Mapping[str, str],
+    **extra,
+) -> Optional[str]:
+    # Only successful, captured reads are cached; None means "do not cache"
+    if _read_cache is None or not capture_output or check:
+        return None
+    if _verb(cmd) not in _READ_VERBS:
+        return None
+    if any(arg.split("=", 1)[0] in _STREAM_FLAGS for arg in cmd):
+        return None
+    # The same command reads another cluster under another kubeconfig/helm env
+    env = {
+        name: value
+        for name, value in environ.items()
+        if name in ("HOME", "KUBECONFIG") or name.startswith("HELM_")
+    }
+    return make_cache_key({"cmd": cmd, "environ": env, **extra})
+
+
+async def _read_bounded(stream: asyncio.StreamReader, limit: int) -> bytes:
+    # Keep at most `limit` bytes, split between the head and the tail, so
+    # memory stays bounded however much the command prints
+    head_size = limit // 2
+    tail_size = limit - head_size
+    head = bytearray()
+    tail = bytearray()
+    total = 0
+    while chunk := await stream.read(_READ_CHUNK):
+        total += len(chunk)
+        if len(head) < head_size:
+            take = head_size - len(head)
+            head += chunk[:take]
+            chunk = chunk[take:]
+        tail += chunk
+        if len(tail) > tail_size:
+            del tail[: len(tail) - tail_size]
+    if total <= limit:
+        return bytes(head + tail)
+    marker = f"\n...[truncated {total - limit} bytes]...\n".encode()
+    return bytes(head + marker + tail)
+
+
+async def _communicate(
+    process: asyncio.subprocess.Process, input: Optional[bytes] = None
+) -> Tuple[bytes, bytes]:
+    # communicate() buffers everything; only bound the reads when configured
+    if not SUBPROCESS_MAX_OUTPUT_BYTES:
+        return await process.communicate(input=input)
+
+    async def feed_stdin():
+        if process.stdin is None:
+            return
+        try:
+            if input:
+                process.stdin.write(input)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # The child exited without reading stdin, as communicate() allows
+            pass
+        process.stdin.close()
+
+    _, stdout_bytes, stderr_bytes = await asyncio.gather(
+        feed_stdin(),
+        _read_bounded(process.stdout, SUBPROCESS_MAX_OUTPUT_BYTES),
+        _read_bounded(process.stderr, SUBPROCESS_MAX_OUTPUT_BYTES),
+    )
+    await process.wait()
+    return stdout_bytes, stderr_bytes
+
+
+def _looks_like_json(data: bytes) -> bool:
+    return _JSON_START.match(data) is not None
+
+
+def truncate_output(text: str, limit: int = _MAX_OUTPUT) -> str:
+    """Cut `text` to `limit` characters, keeping the head and the tail"""
+    # The head and the tail are where headers and errors usually are
+    if len(text) <= limit:
+        return text
+    half = limit // 2
+    return (
+        f"{text[:half]}\n...[truncated {len(text) - limit} characters]...\n"
+        f"{text[-half:]}"
+    )
+
+
+def _wants_json(arg_list: List[str]) -> bool:
+    # JSON only comes back for `-o json` (any spelling) or raw API reads
+    for i, arg in enumerate(arg_list):
+        if arg in _JSON_OUTPUT_ARGS or arg == "--raw" or arg.startswith("--raw="):
+            return True
+        if arg in ("-o", "--output") and arg_list[i + 1 : i + 2] == ["json"]:
+            return True
+    return False
+
+
+@lru_cache(maxsize=8)
+def _merged_env(overrides: Tuple[Tuple[str, str], ...]) -> Dict[str, str]:
+    # Shared by every call with the same overrides, so it must not be mutated
+    return {**os.environ, **dict(overrides)}
+
+
+def _build_env(env: Optional[List[EnvVar]]) -> Optional[Dict[str, str]]:
+    # Subprocesses need a mapping, not a list of EnvVar models; None inherits.
+    # main_no_fm passes the raw tool-call JSON, so entries may also be dicts.
+    if not env:
+        return None
+    return _merged_env(
+        tuple(
+            (var["name"], var["value"])
+            if isinstance(var, Mapping)
+            else (var.name, var.value)
+            for var in env
+        )
     )
 
 
@@ -63,71 +312,74 @@ async def run_kubectl_impl(
       subprocess.CalledProcessError (only when check=True and exit != 0)
     """
     # Ensure `kubectl` binary exists
-    kubectl_path = shutil.which("kubectl")
+    kubectl_path = _which("kubectl", os.environ.get("PATH"))
     if not kubectl_path:
         raise FileNotFoundError("kubectl not found on PATH")
 
     # Normalize args safely
-    if isinstance(args, str):
-        arg_list = shlex.split(args)
-    else:
-        arg_list = list(args)
+    arg_list = _tokenize(args)
 
-    # Build command
-    cmd = [kubectl_path] + arg_list
-    if namespace:
-        cmd += ["--namespace", namespace]
-    if context:
-        cmd += ["--context", context]
-    if kubeconfig:
-        cmd += ["--kubeconfig", kubeconfig]
-
-    if capture_output:
-        # Use asyncio subprocess for async execution
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            env=env,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+    env_dict = _build_env(env)
+    environ = os.environ if env_dict is None else env_dict
+
+    # Build command; kubectl reads only KUBECONFIG from the environment
+    kubeconfig = _unless_in_env(kubeconfig, "KUBECONFIG", environ)
+    cmd = [kubectl_path, *arg_list, *_kubectl_flags(namespace, context, kubeconfig)]
+
+    cache_key = _read_cache_key(cmd, capture_output, check, environ, env=env)
+    if cache_key is not None:
+        cached = await _read_cache.get(cache_key)
+        if cached is not None:
+            return cached.model_copy(deep=True)
+
+    # Every kubectl/helm is a full Go process; cap how many run at once
+    async with _TOOL_SEMAPHORE:
+        if capture_output:
+            # Use asyncio subprocess for async execution
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                env=env_dict,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
         
-        try:
-            stdout_bytes, stderr_bytes = await asyncio.wait_for(
-                process.communicate(), timeout=timeout
+            try:
+                stdout_bytes, stderr_bytes = await asyncio.wait_for(
+                    _communicate(process), timeout=timeout
+                )
+                returncode = process.returncode
+            except asyncio.TimeoutError:
+                await _kill_and_reap(process)
+                raise subprocess.TimeoutExpired(cmd, timeout)
+        else:
+            # Use asyncio subprocess without capturing output
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                env=env_dict,
+                stdout=None,
+                stderr=None
             )
-            stdout = stdout_bytes.decode('utf-8') if stdout_bytes else ""
-            stderr = stderr_bytes.decode('utf-8') if stderr_bytes else ""
-            returncode = process.returncode
-        except asyncio.TimeoutError:
-            process.kill()
-            await process.wait()
-            raise subprocess.TimeoutExpired(cmd, timeout)
-    else:
-        # Use asyncio subprocess without capturing output
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            env=env,
-            stdout=None,
-            stderr=None
-        )
         
-        try:
-            returncode = await asyncio.wait_for(process.wait(), timeout=timeout)
-            stdout = ""
-            stderr = ""
-        except asyncio.TimeoutError:
-            process.kill()
-            await process.wait()
-            raise subprocess.TimeoutExpired(cmd, timeout)
+            try:
+                returncode = await asyncio.wait_for(process.wait(), timeout=timeout)
+                stdout_bytes = stderr_bytes = b""
+            except asyncio.TimeoutError:
+                await _kill_and_reap(process)
+                raise subprocess.TimeoutExpired(cmd, timeout)
 
+    decoded = stdout_bytes.decode("utf-8", errors="replace")
+    stdout = truncate_output(decoded)
+    stderr = truncate_output(stderr_bytes.decode("utf-8", errors="replace"))
+
+    # orjson parses the raw bytes directly, skipping a decode/encode round trip.
+    # Truncated output is not parsed: the JSON would carry all of it back in.
     parsed = None
-    if capture_output and stdout:
-        s = stdout.lstrip()
-        if s.startswith("{") or s.startswith("["):
-            try:
-                parsed = json.loads(stdout)
-            except json.JSONDecodeError:
-                parsed = None
+    parse = capture_output and len(decoded) <= _MAX_OUTPUT
+    if parse and _wants_json(arg_list) and _looks_like_json(stdout_bytes):
+        try:
+            parsed = orjson.loads(stdout_bytes)
+        except orjson.JSONDecodeError:
+            parsed = None
 
     if check and returncode != 0:
         # Mirror subprocess.run(check=True) behavior using CalledProcessError
@@ -136,49 +388,17 @@ async def run_kubectl_impl(
         )
         raise err
 
-    return ExecutionResult(
+    # Fields are built here, not taken from input, so skip re-validating them
+    result = ExecutionResult.model_construct(
         cmd=cmd,
         returncode=returncode,
-        stdout=stdout or "",
-        stderr=stderr or "",
+        stdout=stdout,
+        stderr=stderr,
         json=parsed,
     )
-
-
-@function_tool
-async def run_helm(
-    args: Union[str, Sequence[str]],
-    *,
-    namespace: Optional[str] = None,  # --namespace
-    context: Optional[str] = None,  # --kube-context
-    kubeconfig: Optional[str] = None,  # --kubeconfig
-    repo_config: Optional[
-        str
-    ] = None,  # --repository-config (e.g., path/to/repositories.yaml)
-    registry_config: Optional[
-        str
-    ] = None,  # --registry-config (e.g., path/to/registry.json)
-    timeout: Optional[float] = 60.0,  # seconds; None = no timeout
-    capture_output: bool = True,
-    check: bool = False,  # raise on non-zero exit
-    env: Optional[List[EnvVar]] = None,  # extra env vars (e.g., HELM_*)
-    workdir: Optional[str] = None,  # working directory for helm
-    input_data: Optional[str] = None,  # pass stdin
-) -> ExecutionResult:
-    return await run_helm_impl(
-        args,
-        namespace=namespace,
-        context=context,
-        kubeconfig=kubeconfig,
-        repo_config=repo_config,
-        registry_config=registry_config,
-        timeout=timeout,
-        capture_output=capture_output,
-        check=check,
-        env=env,
-        workdir=workdir,
-        input_data=input_data,
-    )
+    if cache_key is not None and returncode == 0:
+        await _read_cache.set(cache_key, result.model_copy(deep=True))
+    return result
 
 
 async def run_helm_impl(
@@ -215,101 +435,127 @@ async def run_helm_impl(
       subprocess.TimeoutExpired   - if execution exceeds 'timeout'
       subprocess.CalledProcessError (when check=True and exit != 0)
     """
-    helm_path = shutil.which("helm")
+    helm_path = _which("helm", os.environ.get("PATH"))
     if not helm_path:
         raise FileNotFoundError("helm not found on PATH")
 
     # Normalize user args
-    if isinstance(args, str):
-        arg_list = shlex.split(args)
-    else:
-        arg_list = list(args)
+    arg_list = _tokenize(args)
 
-    # Build command
-    cmd = [helm_path] + arg_list
-    if namespace:
-        cmd += ["--namespace", namespace]
-    if context:
-        cmd += ["--kube-context", context]
-    if kubeconfig:
-        cmd += ["--kubeconfig", kubeconfig]
-    if repo_config:
-        cmd += ["--repository-config", repo_config]
-    if registry_config:
-        cmd += ["--registry-config", registry_config]
-
-    if capture_output:
-        # Use asyncio subprocess for async execution with stdin support
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            env=env,
-            cwd=workdir,
-            stdin=asyncio.subprocess.PIPE if input_data else None,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        try:
-            input_data_bytes = input_data.encode() if input_data else None
-            stdout_bytes, stderr_bytes = await asyncio.wait_for(
-                process.communicate(input=input_data_bytes),
-                timeout=timeout
+    env_dict = _build_env(env)
+    environ = os.environ if env_dict is None else env_dict
+
+    # Build command, leaving out flags helm would already take from the env
+    cmd = [
+        helm_path,
+        *arg_list,
+        *_helm_flags(
+            _unless_in_env(namespace, "HELM_NAMESPACE", environ),
+            _unless_in_env(context, "HELM_KUBECONTEXT", environ),
+            _unless_in_env(kubeconfig, "KUBECONFIG", environ),
+            _unless_in_env(repo_config, "HELM_REPOSITORY_CONFIG", environ),
+            _unless_in_env(registry_config, "HELM_REGISTRY_CONFIG", environ),
+        ),
+    ]
+
+    cache_key = _read_cache_key(
+        cmd,
+        capture_output,
+        check,
+        environ,
+        env=env,
+        workdir=workdir,
+        input_data=input_data,
+    )
+    if cache_key is not None:
+        cached = await _read_cache.get(cache_key)
+        if cached is not None:
+            return cached.model_copy(deep=True)
+
+    # Every kubectl/helm is a full Go process; cap how many run at once
+    async with _TOOL_SEMAPHORE:
+        if capture_output:
+            # Use asyncio subprocess for async execution with stdin support
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                env=env_dict,
+                cwd=workdir,
+                stdin=asyncio.subprocess.PIPE if input_data else None,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
             )
-            stdout = stdout_bytes.decode('utf-8') if stdout_bytes else ""
-            stderr = stderr_bytes.decode('utf-8') if stderr_bytes else ""
-            returncode = process.returncode
-        except asyncio.TimeoutError:
-            process.kill()
-            await process.wait()
-            raise subprocess.TimeoutExpired(cmd, timeout)
-    else:
-        # Use asyncio subprocess without capturing output
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            env=env,
-            cwd=workdir,
-            stdin=asyncio.subprocess.PIPE if input_data else None,
-            stdout=None,
-            stderr=None
-        )
         
-        try:
-            if input_data:
-                await asyncio.wait_for(
-                    process.communicate(input=input_data.encode()),
+            try:
+                input_data_bytes = input_data.encode() if input_data else None
+                stdout_bytes, stderr_bytes = await asyncio.wait_for(
+                    _communicate(process, input=input_data_bytes),
                     timeout=timeout
                 )
-            else:
-                await asyncio.wait_for(process.wait(), timeout=timeout)
-            returncode = process.returncode
-            stdout = ""
-            stderr = ""
-        except asyncio.TimeoutError:
-            process.kill()
-            await process.wait()
-            raise subprocess.TimeoutExpired(cmd, timeout)
+                returncode = process.returncode
+            except asyncio.TimeoutError:
+                await _kill_and_reap(process)
+                raise subprocess.TimeoutExpired(cmd, timeout)
+        else:
+            # Use asyncio subprocess without capturing output
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                env=env_dict,
+                cwd=workdir,
+                stdin=asyncio.subprocess.PIPE if input_data else None,
+                stdout=None,
+                stderr=None
+            )
+        
+            try:
+                if input_data:
+                    await asyncio.wait_for(
+                        process.communicate(input=input_data.encode()),
+                        timeout=timeout
+                    )
+                else:
+                    await asyncio.wait_for(process.wait(), timeout=timeout)
+                returncode = process.returncode
+                stdout_bytes = stderr_bytes = b""
+            except asyncio.TimeoutError:
+                await _kill_and_reap(process)
+                raise subprocess.TimeoutExpired(cmd, timeout)
+
+    decoded = stdout_bytes.decode("utf-8", errors="replace")
+    stdout = truncate_output(decoded)
+    stderr = truncate_output(stderr_bytes.decode("utf-8", errors="replace"))
 
     parsed = None
-    if capture_output and stdout:
-        # Best-effort JSON detection/parse
-        s = stdout.lstrip()
-        if s.startswith("{") or s.startswith("["):
-            try:
-                parsed = json.loads(stdout)
-            except json.JSONDecodeError:
-                parsed = None
+    # Best-effort JSON detection/parse, skipped when the output was truncated
+    parse = capture_output and len(decoded) <= _MAX_OUTPUT
+    if parse and _wants_json(arg_list) and _looks_like_json(stdout_bytes):
+        try:
+            parsed = orjson.loads(stdout_bytes)
+        except orjson.JSONDecodeError:
+            parsed = None
 
     if check and returncode != 0:
         raise subprocess.CalledProcessError(
             returncode, cmd, output=stdout, stderr=stderr
         )
 
-    return ExecutionResult(
+    # Fields are built here, not taken from input, so skip re-validating them
+    result = ExecutionResult.model_construct(
         cmd=cmd,
         returncode=returncode,
-        stdout=stdout or "",
-        stderr=stderr or "",
+        stdout=stdout,
+        stderr=stderr,
         json=parsed,
     )
+    if cache_key is not None and returncode == 0:
+        await _read_cache.set(cache_key, result.model_copy(deep=True))
+    return result
 
 
+# Agent-facing tools. The docstrings describe the Python return value, so they
+# are kept out of the schema the model sees.
+run_kubectl = function_tool(
+    run_kubectl_impl, name_override="run_kubectl", use_docstring_info=False
+)
+run_helm = function_tool(
+    run_helm_impl, name_override="run_helm", use_docstring_info=False
+)